@@ -1,13 +1,23 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import datetime
+import functools
+import json
+import pathlib
 from secfsdstools.update import update
 from secfsdstools.c_index.companyindexreading import CompanyIndexReader
 from secfsdstools.c_index.searching import IndexSearch
-from secfsdstools.e_collector.reportcollecting import SingleReportCollector
+from secfsdstools.e_collector.multireportcollecting import MultiReportCollector
 from secfsdstools.e_filter.rawfiltering import ReportPeriodRawFilter
 from secfsdstools.e_presenter.presenting import StandardStatementPresenter
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 
 #List of All Forms
 FORMS_LIST = ['10-12B', '10-12G', '10-12G/A', '10-D', '10-K', '10-K/A', '10-KT', '10-KT/A', '10-Q', '10-Q/A', '10-QT', '10-QT/A', '18-K', '20-F', '20-F/A', '20FR12B', '20FR12G', '40-F', '40-F/A', '424B1', '424B2', '424B3', '424B4', '424B5', '424B7', '425', '6-K', '6-K/A', '8-K', '8-K/A', '8-K12B', '8-K12B/A', '8-K12G3', 'ARS', 'DEF 14A', 'DEF 14C', 'DEFA14A', 'DEFC14A', 'DEFM14A', 'DEFM14C', 'DEFR14A', 'F-1', 'F-1/A', 'F-3', 'F-3/A', 'F-3ASR', 'F-4', 'F-4/A', 'N-2', 'N-2/A', 'N-2ASR', 'N-2MEF', 'N-4', 'N-4/A', 'N-6/A', 'N-CSR', 'N-CSR/A', 'N-CSRS', 'N-CSRS/A', 'NT 10-Q', 'POS 8C', 'POS AM', 'POS AMI', 'POS EX', 'POSASR', 'PRE 14A', 'PREC14A', 'PREM14A', 'PRER14A', 'PRER14C', 'S-1', 'S-1/A', 'S-11', 'S-11/A', 'S-1MEF', 'S-3', 'S-3/A', 'S-3ASR', 'S-4', 'S-4/A', 'SP 15D2']
@@ -19,7 +29,9 @@ class Company:
     def __init__(self, cik):
         self.cik = cik
         self.report_reader = CompanyIndexReader.get_company_index_reader(cik=self.cik)
-        self.consolidated_filings = pd.DataFrame(columns=['tag'])
+        self.consolidated_filings = pa.table({'tag': pa.array([], pa.string()), 'stmt': pa.array([], pa.string())})
+        self._cells = dict()
+        self._dates = []
 
     def get_cik(self):
         return self.cik
@@ -27,67 +39,141 @@ class Company:
     def get_report_reader(self):
         return self.report_reader
 
+    @functools.cached_property
+    def _all_reports(self):
+        # Read the company's report index once and filter it in memory afterwards
+        reports = self.report_reader.get_all_company_reports_df()
+        # Few distinct forms repeat on every report, so filters run on categorical codes
+        reports['form'] = reports['form'].astype('category')
+        return reports
+
     def getAvailableReports(self):
-        return list(self.report_reader.get_all_company_reports_df()['form'].unique())
+        return list(self._all_reports['form'].unique())
 
     def getFilingList(self, reportType, startDate, endDate):
         if reportType == 'All':
-            unfilteredDF = self.report_reader.get_all_company_reports_df()
+            unfilteredDF = self._all_reports
         else:
-            unfilteredDF = self.report_reader.get_all_company_reports_df(forms=reportType)
+            unfilteredDF = self._all_reports[self._all_reports['form'].isin(reportType)]
 
         filteredDF = unfilteredDF[(unfilteredDF.period >= startDate) & (unfilteredDF.period <= endDate)]
         return filteredDF
 
     def appendFilings(self, df, filingDate):
         """
-        Appends new filings data to the consolidated_filings DataFrame from a dataframe input.
-        Includes both tag and stmt columns.
+        Records new filings data for the consolidated_filings Arrow table from a dataframe input.
+        Values are keyed by tag and stmt; call finalize() to build the table.
 
         Parameters:
         - df: pandas DataFrame containing 'tag', 'stmt', and 'merged' columns
         - filingDate: str representing the filing date to be used as column name
         """
-        # Get list of tags from input DataFrame
-        new_tags = df[['tag', 'stmt']].copy()
+        # Register the filing date column if it doesn't exist
+        if filingDate not in self._dates:
+            self._dates.append(filingDate)
 
-        # If this is the first data being added, initialize with both columns
-        if len(self.consolidated_filings) == 0:
-            self.consolidated_filings = pd.DataFrame(columns=['tag', 'stmt'])
+        # Store values for all tag-stmt combinations in the input DataFrame
+        for tag, stmt, merged in zip(df['tag'].to_numpy(), df['stmt'].to_numpy(), df['merged'].to_numpy()):
+            self._cells.setdefault((tag, stmt), {})[filingDate] = merged
 
-        # Convert existing tag-stmt combinations to set for efficient comparison
-        existing_combinations = set(zip(self.consolidated_filings['tag'], self.consolidated_filings['stmt']))
-        new_combinations = set(zip(new_tags['tag'], new_tags['stmt']))
-        combinations_to_add = new_combinations - existing_combinations
+        return
 
-        # Add new tag-stmt combinations if any
-        if combinations_to_add:
-            new_rows = pd.DataFrame(list(combinations_to_add), columns=['tag', 'stmt'])
-            self.consolidated_filings = pd.concat([self.consolidated_filings, new_rows], ignore_index=True)
+    def finalize(self):
+        """
+        Builds the consolidated_filings Arrow table from all appended filings in a single construction.
+        One row per tag-stmt combination and one column per filing date, in the order they were appended.
 
-        # Create the filing date column if it doesn't exist
-        if filingDate not in self.consolidated_filings.columns:
-            self.consolidated_filings[filingDate] = None
+        Returns:
+        pyarrow.Table: the consolidated filings
+        """
+        keys = list(self._cells.keys())
+
+        # Pre-allocate every filing date column as a float64 array and fill it in place
+        columns = {filingDate: np.full(len(keys), np.nan) for filingDate in self._dates}
+        for i, values in enumerate(self._cells.values()):
+            for filingDate, value in values.items():
+                columns[filingDate][i] = value
+
+        # Each column becomes an independent Arrow array from its typed buffer, NaN is stored as null
+        table = {
+            'tag': pa.array([tag for tag, _ in keys], pa.string()),
+            'stmt': pa.array([stmt for _, stmt in keys], pa.string()),
+        }
+        for filingDate, col in columns.items():
+            table[filingDate] = pa.array(col, from_pandas=True)
+
+        self.consolidated_filings = pa.table(table)
+        return self.consolidated_filings
+
+    def release(self):
+        """
+        Frees the appended filings, the consolidated_filings table and the cached report index,
+        e.g. once they have been written to disk.
+        """
+        self._cells = dict()
+        self._dates = []
+        self.consolidated_filings = None
+        self.__dict__.pop('_all_reports', None)
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _pick_values(arr, out):
+        # Same selection rule as select_values, compiled over a float64 buffer.
+        # Rows are independent, so they are split across numba's threads; callers
+        # must not enter this kernel from several Python threads at once.
+        for i in prange(arr.shape[0]):
+            count = 0
+            first = -1
+            last = -1
+            for j in range(arr.shape[1]):
+                v = arr[i, j]
+                if v == v:
+                    count += 1
+                    if first < 0:
+                        first = j
+                    last = j
+            if count == 1:
+                out[i] = arr[i, first]
+            elif count == 2:
+                out[i] = arr[i, last]
+            else:
+                out[i] = np.nan
+
+
+def select_values(cols):
+    """
+    Selects a single value per row from the period columns of a presented statement.
+    Rows with one non-NaN value keep it, rows with two keep the last one, all others get NaN.
+
+    Parameters:
+    - cols: pandas DataFrame containing the columns after 'inpth'
 
-        # Update values for all tags in the input DataFrame
-        for _, row in df.iterrows():
-            mask = (self.consolidated_filings['tag'] == row['tag']) & (self.consolidated_filings['stmt'] == row['stmt'])
-            # Update the value in the filing date column
-            self.consolidated_filings.loc[mask, filingDate] = row['merged']
+    Returns:
+    numpy.ndarray of float64 with one selected value per row
+    """
+    arr = cols.to_numpy(dtype=np.float64, na_value=np.nan)
 
-        # Replace all NaN with None
-        self.consolidated_filings = self.consolidated_filings.replace({np.nan: None})
+    # Use the compiled kernel when numba is available
+    if njit is not None:
+        out = np.empty(arr.shape[0], dtype=np.float64)
+        _pick_values(arr, out)
+        return out
 
-        return
+    mask = ~pd.isna(arr)
+    counts = mask.sum(axis=1)
+    rows = np.arange(arr.shape[0])
 
-def select_value(row):
-    # Get non-NaN values and their indices
-    non_nan = [(i, val) for i, val in enumerate(row) if pd.notna(val)]
-    if len(non_nan) == 1:
-        return non_nan[0][1]
-    elif len(non_nan) == 2:
-        return non_nan[-1][1]
-    return None
+    # Position of the first and last non-NaN value in each row
+    first_idx = mask.argmax(axis=1)
+    last_idx = (arr.shape[1] - 1) - mask[:, ::-1].argmax(axis=1)
+
+    out = np.full(arr.shape[0], np.nan)
+    one = counts == 1
+    two = counts == 2
+    out[one] = arr[rows[one], first_idx[one]]
+    out[two] = arr[rows[two], last_idx[two]]
+    return out
 
 
 def get_complete_filing_years(df):
@@ -98,48 +184,67 @@ def get_complete_filing_years(df):
     Parameters:
     df (pandas.DataFrame): DataFrame containing SEC filings with columns:
         - form: Filing type (10-Q or 10-K)
-        - period: Period end date
+        - period: Period end date as an integer YYYYMMDD
 
     Returns:
     pandas.DataFrame: Filtered DataFrame containing only complete filing years
     """
-    # Convert period to datetime if it's not already
-    df['period'] = pd.to_datetime(df['period'].astype(str), format='%Y%m%d')
-
-    # Extract year from period
-    df['filing_year'] = df['period'].dt.year
-
-    # Create a pivot table to count filing types per year
-    filing_counts = pd.pivot_table(
-        df,
-        index='filing_year',
-        columns='form',
-        values='adsh',
-        aggfunc='count',
-        fill_value=0
-    )
+    # A complete year needs both form types, return early if either is missing
+    if not {'10-Q', '10-K'}.issubset(set(df['form'].unique())):
+        return df.iloc[0:0]
+
+    # Extract year from the integer period, no datetime parsing needed
+    filing_years = df['period'].to_numpy().astype(np.int64) // 10000
+    forms = df['form'].astype('category')
+    is_q = (forms == '10-Q').to_numpy()
+    is_k = (forms == '10-K').to_numpy()
+
+    # Count filing types per year
+    years, year_codes = np.unique(filing_years, return_inverse=True)
+    q_counts = np.bincount(year_codes, weights=is_q, minlength=len(years))
+    k_counts = np.bincount(year_codes, weights=is_k, minlength=len(years))
 
     # Find years with complete sets (3x 10-Q and 1x 10-K)
-    complete_years = filing_counts[
-        (filing_counts['10-Q'] == 3) &
-        (filing_counts['10-K'] == 1)
-        ].index.tolist()
+    complete_years = years[(q_counts == 3) & (k_counts == 1)]
 
     # Filter original dataframe to only include complete years
-    complete_filings = df[
-        (df['filing_year'].isin(complete_years)) &
-        (df['form'].isin(['10-Q', '10-K']))
-        ].copy()
+    complete_filings = df[np.isin(filing_years, complete_years) & (is_q | is_k)]
 
-    # Sort by period date
-    complete_filings = complete_filings.sort_values('period')
-
-    # Drop the temporary filing_year column
-    complete_filings = complete_filings.drop('filing_year', axis=1)
+    # Sort by period date, integer YYYYMMDD preserves chronological order
+    order = np.argsort(complete_filings['period'].to_numpy(), kind='stable')
+    complete_filings = complete_filings.iloc[order]
 
     return complete_filings
 
 
+def process_filings(rawdatabag, completeFilings):
+    """
+    Presents all reports of a batch-collected bag at once and selects their merged values.
+
+    Parameters:
+    - rawdatabag: RawDataBag holding the current period data of all reports of a company
+    - completeFilings: pandas DataFrame of the collected filings with 'adsh' and 'period' columns
+
+    Returns:
+    list of (filing date string, pandas DataFrame with 'tag', 'stmt' and 'merged' columns), in completeFilings order
+    """
+    #Obtain data associated with all reports in a single presentation
+    df = rawdatabag.join().present(StandardStatementPresenter())
+    # Obtain only the data associated from three months ended periods.
+    inpth_idx = df.columns.get_loc('inpth')
+    merged = select_values(df.iloc[:, inpth_idx + 1:])
+    # Keep only the columns appendFilings needs, the wide presented table is dropped here
+    selected = pd.DataFrame({'adsh': df['adsh'].to_numpy(), 'tag': df['tag'].to_numpy(),
+                             'stmt': df['stmt'].to_numpy(), 'merged': merged})
+    filingsByAdsh = {adsh: group for adsh, group in selected.groupby('adsh', sort=False)}
+
+    results = []
+    for row in completeFilings.itertuples():
+        filingDate = datetime.datetime.strptime(str(row.period), '%Y%m%d').strftime('%d_%m_%Y')
+        # Reports without any current period data still get their (empty) filing date column
+        results.append((filingDate, filingsByAdsh.get(row.adsh, selected.iloc[0:0])))
+    return results
+
 
 #Downloads complete set of 10K/Q forms
 if __name__ == '__main__':
@@ -158,21 +263,32 @@ if __name__ == '__main__':
         "NVIDIA CORP"
     ]
 
-    #Determine Company CIK from Name
+    #Determine Company CIK from Name, reusing selections cached by previous runs
     companyObjDict = dict()
-    index_search = IndexSearch.get_index_search()
+    cikCachePath = pathlib.Path('cik_cache.json')
+    cikCache = json.loads(cikCachePath.read_text()) if cikCachePath.exists() else dict()
+    index_search = None
     for c in companyNames:
+        if c in cikCache:
+            print("CIK for {} : {} (cached)".format(c, cikCache[c]['cik']))
+            companyObjDict[cikCache[c]['name']] = Company(cik=cikCache[c]['cik'])
+            continue
+        if index_search is None:
+            index_search = IndexSearch.get_index_search()
         results = index_search.find_company_by_name(c)
         if len(results) == 1:
             print("CIK for {} : {}".format(c, results.iloc[0]['cik']))
-            companyObjDict[c] = Company(cik=results.iloc[0]['cik'])
+            cikCache[c] = {'name': c, 'cik': int(results.iloc[0]['cik'])}
         else:
             print("-------------------------------------------------")
             print("Multiple CIK for company name {} found:".format(c))
             for index, row in results.iterrows():
                 print(index, row['cik'], row['name'])
             selectedIndex = int(input("Select company index from list: "))
-            companyObjDict[results.iloc[selectedIndex]['name']] = Company(cik=results.iloc[selectedIndex]['cik'])
+            cikCache[c] = {'name': results.iloc[selectedIndex]['name'], 'cik': int(results.iloc[selectedIndex]['cik'])}
+        companyObjDict[cikCache[c]['name']] = Company(cik=cikCache[c]['cik'])
+        #Persist each new selection right away so an interrupted run keeps earlier picks
+        cikCachePath.write_text(json.dumps(cikCache, indent=2))
 
 
     #Process numerical financial information using 10K/Q
@@ -182,20 +298,21 @@ if __name__ == '__main__':
         #Determine which items of filing list have complete periods meaning three 10Q and one 10k per year
         completeFilings = get_complete_filing_years(filingList)
         print("Company {} has {} available 10K/Q reports, processing...".format(name, completeFilings.shape[0]))
-        for row in completeFilings.itertuples():
-            collector: SingleReportCollector = SingleReportCollector.get_report_by_adsh(adsh=row.adsh)
-            rawdatabag = collector.collect()
-            #Obtain data associated with this current period
-            df = (rawdatabag.filter(ReportPeriodRawFilter()).join().present(StandardStatementPresenter()))
-            # Obtain only the data associated from three months ended periods.
-            cols_after_inpth = df.loc[:, df.columns[df.columns.get_loc('inpth') + 1:]]
-            df['merged'] = cols_after_inpth.apply(select_value, axis=1)
-            #Append merged column to company object after obtaining the filing date
-            companyObjDict[name].appendFilings(df, row.period.strftime('%d_%m_%Y'))
-
-    #Create datasets of completed consolidated findings.
-    for name, obj in companyObjDict.items():
+        #Nothing to collect without complete filing years, an empty table is still written below
+        if not completeFilings.empty:
+            #Collect all reports in one batch and keep only data associated with each report's current period
+            collector: MultiReportCollector = MultiReportCollector.get_reports_by_adshs(adshs=completeFilings['adsh'].tolist())
+            rawdatabag = collector.collect().filter(ReportPeriodRawFilter())
+            for filingDate, df in process_filings(rawdatabag, completeFilings):
+                #Append merged column to company object after obtaining the filing date
+                companyObjDict[name].appendFilings(df, filingDate)
+
+        #Create dataset of completed consolidated findings and free it before the next company.
         filename = f"companyObjDict__{name}__consolidated_filings.csv"
-        obj.consolidated_filings.to_csv(filename, index=True)
+        consolidated = obj.finalize()
+        #Keep the leading unnamed row index column, readers load these files with index_col=0
+        consolidated = consolidated.add_column(0, '', pa.array(np.arange(consolidated.num_rows)))
+        pacsv.write_csv(consolidated, filename)
+        obj.release()
 
 